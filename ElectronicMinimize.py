@@ -2,7 +2,7 @@
 # Author: Yalcin Ozhabes
 # email: yalcinozhabes@gmail.com
 
-import copy
+import logging
 import time
 import numpy as np
 from mpi4py import MPI
@@ -16,61 +16,137 @@ try:
     from JDFTxCalcGPU import JDFTxCalcGPU
 except ImportError:
     JDFTxCalcGPU = JDFTxCalcCPU
-
-class ElectronicMinimize(JDFTxCalcCPU, Calculator):
+try:
+    from numba import njit
+except ImportError:
+    njit = None
+
+# unit conversions from JDFTx (Hartree, Bohr) to ASE (eV, Angstrom)
+_E2EV = float(Hartree)
+_F_CONV = float(Hartree) / float(Bohr)
+_INV_BOHR = 1.0 / float(Bohr)
+
+_logger = logging.getLogger(__name__)
+# time.perf_counter is Python 3 only
+_timer = getattr(time, 'perf_counter', time.time)
+
+if njit is not None:
+    # Serial on purpose: N is small and a numba thread pool in every MPI
+    # rank would compete with the JDFTx threads.
+    @njit(cache=True)
+    def _gather3(x, idx, out, scale):
+        """out[i] = x[idx[i]] * scale for (N, 3) arrays in a single pass"""
+        for i in range(idx.shape[0]):
+            j = idx[i]
+            out[i, 0] = x[j, 0] * scale
+            out[i, 1] = x[j, 1] * scale
+            out[i, 2] = x[j, 2] * scale
+        return out
+else:
+    def _gather3(x, idx, out, scale):
+        """out[i] = x[idx[i]] * scale for (N, 3) arrays"""
+        # idx is a valid permutation, mode='clip' avoids a temporary buffer
+        np.take(x, idx, axis=0, out=out, mode='clip')
+        out *= scale
+        return out
+
+class _JDFTOrderMixin(object):
     """
-    A calculator derived from JDFTxCalcCPU.
+    Shared by the ElectronicMinimize calculators.
+
+    Converts between the ASE order of atoms and the JDFTx order (atoms grouped
+    by species) and implements the ASE calculator interface on top of
+    JDFTxCalcCPU/JDFTxCalcGPU. It has to come first in the list of bases.
     """
     implemented_properties = ['energy', 'forces']
-
-    @staticmethod
-    def _changeOrder(x, indexList):
-        if isinstance(x, np.ndarray):
-            out = copy.copy(x)
-            for i, ind in enumerate(indexList):
-                out[ind] = x[i]
-            return out
-        elif isinstance(x, Atoms):
-            out = [0] * len(x)
-            for i, ind in enumerate(indexList):
-                out[ind] = copy.copy(x[i])
-            return Atoms(out)
-        else:
-            raise TypeError("Can change the order of np.ndarray or ase.Atoms")
+    _profile = False
 
     @staticmethod
     def _createIndexLists(atoms):
         """JDFT has atoms ordered by their symbols so we need conversion tables
-        of indices:"""
-        symbols = {}  # count number of occurances
-        species_order = []
-        for atom in atoms:
-            try:
-                symbols[atom.symbol] += 1
-            except KeyError:
-                species_order.append(atom.symbol)
-                symbols[atom.symbol] = 0
-        i = 0
-        for sp in species_order:
-            number_of_sp = symbols[sp] + 1
-            symbols[sp] = i
-            i += number_of_sp
-        toJDFTOrderIndexList = [0] * len(atoms)
-        fromJDFTOrderIndexList = [0] * len(atoms)
-        for ind, atom in enumerate(atoms):
-            toJDFTOrderIndexList[ind] = symbols[atom.symbol]
-            fromJDFTOrderIndexList[symbols[atom.symbol]] = ind
-            symbols[atom.symbol] += 1
-        return (toJDFTOrderIndexList, fromJDFTOrderIndexList)
-
-    def _toJDFTOrder(self, x):
-        return self._changeOrder(x, self._toJDFTOrderIndexList)
-
-    def _fromJDFTOrder(self, x):
-        return self._changeOrder(x, self._fromJDFTOrderIndexList)
+        of indices. Species are ordered by their first appearance in atoms."""
+        numbers = np.asarray(atoms.numbers)
+        _, firstSeen, species = np.unique(numbers, return_index=True,
+                                          return_inverse=True)
+        # stable sort keeps the original order of atoms within a species
+        fromJDFTOrderIndexArr = np.argsort(firstSeen[species], kind='stable')
+        toJDFTOrderIndexArr = np.empty_like(fromJDFTOrderIndexArr)
+        toJDFTOrderIndexArr[fromJDFTOrderIndexArr] = np.arange(len(numbers))
+        return (toJDFTOrderIndexArr, fromJDFTOrderIndexArr)
+
+    def _setupIons(self, atoms, pspots=None):
+        """Add the ions in atoms to JDFTx and run setup()"""
+        self._toJDFTOrderIndexArr, self._fromJDFTOrderIndexArr = self._createIndexLists(atoms)
+        self.cell = atoms.cell
+
+        # properties that are not computed, shared by all results
+        self._zero6 = np.zeros(6)
+        self._zero3 = np.zeros(3)
+        self._zeroN = np.zeros(len(atoms))
+        for zeros in (self._zero6, self._zero3, self._zeroN):
+            zeros.setflags(write=False)
+        # scratch space for the displacements in updateAtomicPositions
+        self._dposBuffer = np.empty((len(atoms), 3), dtype=np.double)
+
+        self.add_ions_bulk(atoms.positions, atoms.get_chemical_symbols(),
+                           list(pspots) if pspots else None)
+        if self._profile:
+            t0 = _timer()
+        self.setup()
+        if self._profile:
+            _logger.info("Wall Time for e.setup() %g seconds",
+                         _timer() - t0)
+
+    def _finalize_forces(self, forces):
+        """Convert forces read from JDFTx to eV/Angstrom in ASE order"""
+        forces = np.asarray(forces).reshape(-1, 3)
+        return _gather3(forces, self._toJDFTOrderIndexArr,
+                        np.empty_like(forces), _F_CONV)
+
+    def updateAtomicPositions(self):
+        """"""
+        # displacements in JDFTx order and units
+        jdftPos = np.asarray(self.getIonicPositions())
+        dpos = _gather3(np.ascontiguousarray(self.atoms.positions),
+                        self._fromJDFTOrderIndexArr,
+                        self._dposBuffer, _INV_BOHR)
+        dpos -= jdftPos
+        super(_JDFTOrderMixin, self).updateIonicPositions(dpos)
+
+    def calculate(self, atoms=None, properties=['energy'],
+                  system_changes=all_changes):
+        """Run one electronic minimize loop"""
+        super(_JDFTOrderMixin, self).calculate(atoms, properties, system_changes)
+        if 'positions' in system_changes:
+            self.updateAtomicPositions()
+        else:
+            _logger.debug("system changes: %s", system_changes)
+
+        if self._profile:
+            t0 = _timer()
+        self.runElecMin()
+        if self._profile:
+            _logger.info("Wall Time for self.runElecMin() %g seconds",
+                         _timer() - t0)
+
+        energy = self.readTotalEnergy() * _E2EV
+        forces = self._finalize_forces(self.readForces())
+        self.results = {'energy': energy,
+                        'forces': forces,
+                        'stress': self._zero6,
+                        'dipole': self._zero3,
+                        'charges': self._zeroN,
+                        'magmom': 0.0,
+                        'magmoms': self._zeroN}
+
+class ElectronicMinimize(_JDFTOrderMixin, JDFTxCalcCPU, Calculator):
+    """
+    A calculator derived from JDFTxCalcCPU.
+    """
 
     def __init__(self, restart=None, ignore_bad_restart_file=False,
                  atoms=None, log=True, comm=None, **kwargs):
+        self._profile = kwargs.pop('profile', False)
         Calculator.__init__(self, restart, ignore_bad_restart_file,
                             "JDFT", atoms, **kwargs)
         nThreads = kwargs['nThreads'] if 'nThreads' in kwargs else None
@@ -87,114 +163,24 @@ class ElectronicMinimize(JDFTxCalcCPU, Calculator):
         elif not isinstance(atoms, Atoms):
             raise TypeError("atoms should be ase.Atoms type.")
 
-        self._toJDFTOrderIndexList, self._fromJDFTOrderIndexList = self._createIndexLists(atoms)
-        self.cell = atoms.cell
-
         if 'pseudopotential' in atoms.info:
-            pspots = [atoms.info[pseudopotential]] * len(atoms)
+            pspots = [atoms.info['pseudopotential']] * len(atoms)
         elif 'pseudopotentials' in atoms.info:
             pspots = atoms.info['pseudopotentials']
             assert len(pspots) == len(atoms)
         else:
             pspots = None
-        for i, atom in enumerate(atoms):
-            if pspots:
-                atom.data['pseudopotential'] = pspots[i]
-            self.add_ion(atom)
-        t0 = time.time()
-        c0 = time.clock()
-        self.setup()
-        print("Wall Time for e.setup()", time.time()-t0, "seconds")
-        print("Process Time for e.setup()", time.clock()-c0, "seconds")
-
-    def updateAtomicPositions(self):
-        """"""
-        dpos = self.atoms.positions - self._fromJDFTOrder(self.getIonicPositions() * Bohr)
-        super(ElectronicMinimize, self).updateIonicPositions(self._toJDFTOrder(dpos / Bohr))
+        self._setupIons(atoms, pspots)
 
-    def calculate(self, atoms=None, properties=['energy'],
-                  system_changes=all_changes):
-        """Run one electronic minimize loop"""
-        super(ElectronicMinimize, self).calculate(atoms, properties, system_changes)
-        if 'positions' in system_changes:
-            self.updateAtomicPositions()
-        else:
-            print(system_changes)
-
-        t0 = time.time()
-        c0 = time.clock()
-        self.runElecMin()
-        print("Wall Time for self.runElecMin()", time.time()-t0, "seconds")
-        print("Process Time for self.runElecMin()", time.clock()-c0, "seconds")
-
-        energy = self.readTotalEnergy() * Hartree
-        forces = np.asarray(self.readForces(), dtype=np.double)
-        forces.resize((len(atoms), 3))
-        forces = self._fromJDFTOrder(forces)
-        forces = forces * Hartree / Bohr
-        self.results = {'energy': energy,
-                        'forces': forces,
-                        'stress': np.zeros(6),
-                        'dipole': np.zeros(3),
-                        'charges': np.zeros(len(atoms)),
-                        'magmom': 0.0,
-                        'magmoms': np.zeros(len(atoms))}
-
-class ElectronicMinimizeGPU(JDFTxCalcGPU, Calculator):
+class ElectronicMinimizeGPU(_JDFTOrderMixin, JDFTxCalcGPU, Calculator):
     """
     A calculator derived from JDFTxCalcGPU.
     """
-    implemented_properties = ['energy', 'forces']
-
-    @staticmethod
-    def _changeOrder(x, indexList):
-        if isinstance(x, np.ndarray):
-            out = copy.copy(x)
-            for i, ind in enumerate(indexList):
-                out[ind] = x[i]
-            return out
-        elif isinstance(x, Atoms):
-            out = [0] * len(x)
-            for i, ind in enumerate(indexList):
-                out[ind] = copy.copy(x[i])
-            return Atoms(out)
-        else:
-            raise TypeError("Can change the order of np.ndarray or ase.Atoms")
-
-    @staticmethod
-    def _createIndexLists(atoms):
-        """JDFT has atoms ordered by their symbols so we need conversion tables
-        of indices:"""
-        symbols = {}  # count number of occurances
-        species_order = []
-        for atom in atoms:
-            try:
-                symbols[atom.symbol] += 1
-            except KeyError:
-                species_order.append(atom.symbol)
-                symbols[atom.symbol] = 0
-        i = 0
-        for sp in species_order:
-            number_of_sp = symbols[sp] + 1
-            symbols[sp] = i
-            i += number_of_sp
-        toJDFTOrderIndexList = [0] * len(atoms)
-        fromJDFTOrderIndexList = [0] * len(atoms)
-        for ind, atom in enumerate(atoms):
-            toJDFTOrderIndexList[ind] = symbols[atom.symbol]
-            fromJDFTOrderIndexList[symbols[atom.symbol]] = ind
-            symbols[atom.symbol] += 1
-        return (toJDFTOrderIndexList, fromJDFTOrderIndexList)
-
-    def _toJDFTOrder(self, x):
-        return self._changeOrder(x, self._toJDFTOrderIndexList)
-
-    def _fromJDFTOrder(self, x):
-        return self._changeOrder(x, self._fromJDFTOrderIndexList)
 
     def __init__(self, restart=None, ignore_bad_restart_file=False,
                  atoms=None, log=True, comm=None, **kwargs):
-        print "ElecMinGPU init running"
+        self._profile = kwargs.pop('profile', False)
+        print("ElecMinGPU init running")
         Calculator.__init__(self, restart, ignore_bad_restart_file,
                             "JDFT", atoms, **kwargs)
         nThreads = kwargs['nThreads'] if 'nThreads' in kwargs else None
@@ -209,45 +195,4 @@ class ElectronicMinimizeGPU(JDFTxCalcGPU, Calculator):
         elif not isinstance(atoms, Atoms):
             raise TypeError("atoms should be ase.Atoms type.")
 
-        self._toJDFTOrderIndexList, self._fromJDFTOrderIndexList = self._createIndexLists(atoms)
-        self.cell = atoms.cell
-        for atom in atoms:
-            self.add_ion(atom)
-        t0 = time.time()
-        c0 = time.clock()
-        self.setup()
-        print("Wall Time for e.setup()", time.time()-t0, "seconds")
-        print("Process Time for e.setup()", time.clock()-c0, "seconds")
-
-    def updateAtomicPositions(self):
-        """"""
-        dpos = self.atoms.positions - self._fromJDFTOrder(self.getIonicPositions() * Bohr)
-        super(ElectronicMinimizeGPU, self).updateIonicPositions(self._toJDFTOrder(dpos / Bohr))
-
-    def calculate(self, atoms=None, properties=['energy'],
-                  system_changes=all_changes):
-        """Run one electronic minimize loop"""
-        super(ElectronicMinimizeGPU, self).calculate(atoms, properties, system_changes)
-        if 'positions' in system_changes:
-            self.updateAtomicPositions()
-        else:
-            print(system_changes)
-
-        t0 = time.time()
-        c0 = time.clock()
-        self.runElecMin()
-        print("Wall Time for self.runElecMin()", time.time()-t0, "seconds")
-        print("Process Time for self.runElecMin()", time.clock()-c0, "seconds")
-
-        energy = self.readTotalEnergy() * Hartree
-        forces = np.asarray(self.readForces(), dtype=np.double)
-        forces.resize((len(atoms), 3))
-        forces = self._fromJDFTOrder(forces)
-        forces = forces * Hartree / Bohr
-        self.results = {'energy': energy,
-                        'forces': forces,
-                        'stress': np.zeros(6),
-                        'dipole': np.zeros(3),
-                        'charges': np.zeros(len(atoms)),
-                        'magmom': 0.0,
-                        'magmoms': np.zeros(len(atoms))}
+        self._setupIons(atoms)
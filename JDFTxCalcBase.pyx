@@ -287,31 +287,27 @@ cdef class JDFTxCalc{TARGET}:
     def setGlobals(self):
         self.setGlobalsInline()
 
-    def add_ion(self, atom):
-        """
+    cdef shared_ptr[SpeciesInfo] _getSpecies(self, symbol, pseudopotential) except *:
         """
-        cdef char* symbol = pyStrToCharStar(atom.symbol)
+        Find the species with the given symbol, create it if it doesn't exist.
 
+        pseudopotential is None, one of 'uspp', 'fhi', 'upf' or a path to a
+        pseudopotential file. It is ignored if the species already exists.
+        """
         cdef string id
-        cdef vector3[double] pos
-        id.assign(symbol)
+        id.assign(pyStrToCharStar(symbol))
         cdef shared_ptr[SpeciesInfo] sp
         sp = findSpecies(id, self.e)
 
-        invCell = np.linalg.inv(self.cell)
-        positionInLatticeCoordinates = atom.position.dot(invCell)
-        for i in range(3):
-            pos[i] = <double>positionInLatticeCoordinates[i]
-
         if sp != 0:
             pass
-        elif 'pseudopotential' in atom.data:
-            if atom.data['pseudopotential'].lower() in ['uspp', 'fhi', 'upf']:
-                pspFile = _makePspPath(atom.symbol, atom.data['pseudopotential'].lower())
-            elif os.path.exists(atom.data['pseudopotential']):
-                pspFile = atom.data['pseudopotential']
+        elif pseudopotential is not None:
+            if pseudopotential.lower() in ['uspp', 'fhi', 'upf']:
+                pspFile = _makePspPath(symbol, pseudopotential.lower())
+            elif os.path.exists(pseudopotential):
+                pspFile = pseudopotential
             else:
-                raise ValueError("Can't find file " + atom.data['pseudopotential'] +
+                raise ValueError("Can't find file " + pseudopotential +
                                  " or unknown format.")
 
             if pspFile.lower().endswith("uspp"):
@@ -325,9 +321,17 @@ cdef class JDFTxCalc{TARGET}:
                                   pspFile)
             self.e.iInfo.species.push_back(sp)
         else:
-            pspFile = _makePspPath(atom.symbol)
+            pspFile = _makePspPath(symbol)
             sp = newSpecies(id, pyStrToCharStar(pspFile), PspFormat_Uspp)
             self.e.iInfo.species.push_back(sp)
+        return sp
+
+    cdef void _pushIon(self, shared_ptr[SpeciesInfo] sp,
+                       double[:] positionInLatticeCoordinates):
+        """Append an ion at the given lattice coordinates to the species."""
+        cdef vector3[double] pos
+        for i in range(3):
+            pos[i] = positionInLatticeCoordinates[i]
         deref(sp).atpos.push_back(pos)
 
         cdef Species_Constraint constraint
@@ -335,6 +339,41 @@ cdef class JDFTxCalc{TARGET}:
         constraint.type = Species_Constraint_None
         deref(sp).constraints.push_back(constraint)
 
+    def add_ion(self, atom):
+        """
+        """
+        pseudopotential = atom.data['pseudopotential'] \
+                          if 'pseudopotential' in atom.data else None
+        cdef shared_ptr[SpeciesInfo] sp = self._getSpecies(atom.symbol, pseudopotential)
+
+        invCell = np.linalg.inv(self.cell)
+        positionInLatticeCoordinates = atom.position.dot(invCell)
+        self._pushIon(sp, np.ascontiguousarray(positionInLatticeCoordinates,
+                                               dtype=np.double))
+
+    def add_ions_bulk(self, positions, list symbols, list pspots=None):
+        """
+        Add many ions with a single call.
+
+        positions: (N, 3) array of cartesian positions in Angstrom.
+        symbols: list of N chemical symbols.
+        pspots: None or a list of N pseudopotentials as accepted by add_ion.
+
+        The lattice is inverted once and all positions are converted to
+        lattice coordinates in one matrix product.
+        """
+        cdef double[:, :] latticePositions = np.ascontiguousarray(
+            np.dot(positions, np.linalg.inv(self.cell)), dtype=np.double)
+        if latticePositions.shape[0] != len(symbols):
+            raise ValueError("positions and symbols must have the same length")
+        if pspots is not None and len(pspots) != len(symbols):
+            raise ValueError("pspots and symbols must have the same length")
+        cdef shared_ptr[SpeciesInfo] sp
+        for i in range(len(symbols)):
+            sp = self._getSpecies(symbols[i],
+                                  None if pspots is None else pspots[i])
+            self._pushIon(sp, latticePositions[i])
+
     def setup(self):
         """
         Runs Everything.setup()
@@ -354,14 +393,20 @@ cdef class JDFTxCalc{TARGET}:
         """
         cdef extern vector3[double] operator*(matrix3[double], vector3[double]&)
         cdef shared_ptr[SpeciesInfo] sp
-        atpos = []
+        cdef vector3[double] r
+        cdef int row = 0
+        nAtoms = 0
+        for i in range(self.e.iInfo.species.size()):
+            nAtoms += deref(self.e.iInfo.species[i]).atpos.size()
+        atpos = np.empty((nAtoms, 3), dtype = np.double)
+        cdef double[:, ::1] atposView = atpos
         for i in range(self.e.iInfo.species.size()):
             sp = self.e.iInfo.species[i]
             for j in range(deref(sp).atpos.size()):
+                r = self.e.gInfo.R * deref(sp).atpos[j]
                 for k in range(3):
-                    atpos.append((self.e.gInfo.R * deref(sp).atpos[j])[k])
-        atpos = np.asarray(atpos, dtype = np.double)
-        atpos.resize((len(atpos)/3,3))
+                    atposView[row, k] = r[k]
+                row += 1
         return atpos
 
     def updateIonicPositions(self, double[:,:] dpos):
@@ -392,11 +437,21 @@ cdef class JDFTxCalc{TARGET}:
         return double(self.e.ener.E)
 
     def readForces(self):
+        """
+        Returns np.ndarray of forces in cartesian coordinates, in JDFTx order.
+        """
         cdef extern vector3[double] operator*(matrix3[double], vector3[double]&)
-        forces = []
-        # cdef size_t i, j, k
-        for i in range(int(self.e.iInfo.forces.size())):
-            for j in range(int(self.e.iInfo.forces[i].size())):
+        cdef vector3[double] f
+        cdef int row = 0
+        nAtoms = 0
+        for i in range(self.e.iInfo.forces.size()):
+            nAtoms += self.e.iInfo.forces[i].size()
+        forces = np.empty((nAtoms, 3), dtype = np.double)
+        cdef double[:, ::1] forcesView = forces
+        for i in range(self.e.iInfo.forces.size()):
+            for j in range(self.e.iInfo.forces[i].size()):
+                f = self.e.gInfo.invRT * self.e.iInfo.forces[i][j]
                 for k in range(3):
-                    forces.append((self.e.gInfo.invRT * self.e.iInfo.forces[i][j])[k])
+                    forcesView[row, k] = f[k]
+                row += 1
         return forces
@@ -14,9 +14,24 @@ from distutils import log
 from Cython.Distutils import build_ext
 from Cython.Build import cythonize
 
+def availableCores():
+    """Number of cores this process may run on.
+
+    Respects the affinity mask (and so cgroup cpusets in containers) where
+    the platform supports it, otherwise falls back to the total core count.
+    """
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return multiprocessing.cpu_count()
+
 # Use parallel compilation on this number of cores.
-nthreads = int(os.getenv('COMPILE_NTHREADS', multiprocessing.cpu_count() ))
+nthreads = int(os.getenv('COMPILE_NTHREADS', availableCores()))
 isRoot = os.geteuid() == 0  # Do we have root privileges?
+# Tune the extensions for the build machine (not portable to other CPUs).
+nativeBuild = os.getenv('JDFTX_NATIVE', '0') == '1'
+# Relax IEEE floating point semantics and enable link time optimization.
+fastBuild = os.getenv('JDFTX_FAST', '0') == '1'
 
 class inTempFolder:
     """Context manager for working in temporary folder.
@@ -105,8 +120,11 @@ def make_extension(ext_name, ext_libraries=(), is_directory=False, enableGPU=0):
         libraries=ext_libraries,
         library_dirs=[jdftxLibDir],
         runtime_library_dirs=[jdftxLibDir],
-        extra_compile_args=['-std=c++0x', '-O3', '-DMPI_ENABLED'] +
+        extra_compile_args=['-std=c++11', '-O3', '-DMPI_ENABLED'] +
+                            ['-ffast-math', '-fno-math-errno', '-flto'] * fastBuild +
+                            ['-march=native'] * nativeBuild +
                             ['-DGPU_ENABLED'] * enableGPU,
+        extra_link_args=['-flto'] * fastBuild,
         #depends=["jdftx/libjdftx.so"],
     )
 